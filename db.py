@@ -1,17 +1,97 @@
 # db.py
 import os
+import logging
+from functools import lru_cache
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
 from dotenv import load_dotenv
 
-# Load environment variables from .env
+# pyodbc keeps its own driver-manager pool underneath SQLAlchemy's QueuePool,
+# which leaks memory on Azure SQL. Turn it off before any connection is made.
+try:
+    import pyodbc
+    pyodbc.pooling = False
+except ImportError:  # non-ODBC DB_URL (e.g. local sqlite)
+    pyodbc = None
+
+# Load environment variables from .env. This is the app's only load_dotenv()
+# call; modules reading env at import time must import db first.
 load_dotenv()
 
 DB_URL = os.getenv("DB_URL")
 if not DB_URL:
     raise RuntimeError("DB_URL is not set in environment")
 
-# Create the SQLAlchemy engine
-_engine = create_engine(DB_URL, pool_pre_ping=True, pool_recycle=1800)
+# gunicorn threads per worker when GUNICORN_THREADS is unset; keep in step with
+# the ${GUNICORN_THREADS:-8} default in the Dockerfile and Procfile.
+DEFAULT_GUNICORN_THREADS = 8
+
+# Pool sizing: each gunicorn worker process has its own engine and pool, so keep
+# DB_POOL_SIZE >= threads per worker (DEFAULT_GUNICORN_THREADS) so requests
+# don't queue waiting for a connection. Total DB logins can reach
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW).
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "30"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds
+# Connections to open at boot (0 disables). A thread holds at most one
+# connection, so default to the worker's thread count.
+GUNICORN_THREADS = int(os.getenv("GUNICORN_THREADS", str(DEFAULT_GUNICORN_THREADS)))
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", str(GUNICORN_THREADS)))
+
+log = logging.getLogger(__name__)
 
+def warmup(engine, count: int) -> None:
+    """
+    Open `count` connections at once, then hand them back to the pool so the
+    TLS/ODBC handshakes happen at process boot instead of on first requests.
+    A failure here is logged, not raised: the app still starts and the pool
+    fills lazily.
+    """
+    conns = []
+    try:
+        for _ in range(count):
+            conns.append(engine.connect())
+    except SQLAlchemyError as e:
+        log.warning("DB pool warmup stopped after %d connection(s): %s", len(conns), e)
+    finally:
+        for conn in conns:
+            conn.close()
+
+@lru_cache(maxsize=1)
 def get_engine():
-    return _engine
+    """
+    Create the SQLAlchemy engine on the first call and return that same engine
+    afterwards: one engine (and pool) per process. run.py calls this at import,
+    so in practice the engine is built, and its pool warmed, when run.py is
+    imported. Separate processes (reloader child, each forked RQ job) each
+    build their own.
+    """
+    url = make_url(DB_URL)
+    # SQL Server via pyodbc: bind executemany() parameters as ODBC arrays so a
+    # batch of rows goes to the server in one round-trip instead of one per row.
+    dialect_kwargs = (
+        {"fast_executemany": True}
+        if url.get_backend_name() == "mssql" and url.get_driver_name() == "pyodbc"
+        else {}
+    )
+    engine = create_engine(
+        url,
+        **dialect_kwargs,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+    )
+    if DB_POOL_WARMUP > 0:
+        warmup(engine, min(DB_POOL_WARMUP, DB_POOL_SIZE))
+    return engine
+
+def dispose_engine() -> None:
+    """
+    Close every pooled connection (e.g. at the end of a test run). The engine
+    itself stays cached and opens fresh connections if used again.
+    """
+    if get_engine.cache_info().currsize:
+        get_engine().dispose()
@@ -2,43 +2,116 @@
 import os
 import io
 import re
-from typing import Optional, List, Dict
+import csv
+import itertools
+import hashlib
+import uuid
+from typing import Optional, List, Dict, Tuple
 from datetime import datetime, date
-import json
+import threading
+from functools import lru_cache
 
+import orjson
+from cachetools import TTLCache, cached
 from flask import (
-    Flask, jsonify, render_template, request, redirect, url_for, flash
+    Flask, jsonify, render_template, request, redirect, url_for, flash,
+    make_response, abort,
 )
-from dotenv import load_dotenv
+from redis import ConnectionPool, Redis, RedisError
+from rq import Queue, Worker
+from rq.exceptions import NoSuchJobError
+from rq.job import Job, JobStatus
 from sqlalchemy import text
-import pandas as pd
 from dateutil import parser as dateparser  # installed with pandas
 
 # --------------------------
 # App setup
 # --------------------------
-load_dotenv()  # load env vars early
-from db import get_engine  # noqa: E402  (import after load_dotenv)
+from db import get_engine  # loads .env; keep above any os.getenv() reads
+
+ENGINE = get_engine()  # created (and pool warmed) at boot; handlers use ENGINE directly
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET", "dev-secret")
 
 # Optional: cap CSV size (bytes). Set env MAX_CSV_MB to override (default 5 MB).
 MAX_CSV_BYTES = int(float(os.getenv("MAX_CSV_MB", "5")) * 1024 * 1024)
+# Reject oversized request bodies before Werkzeug parses/spools them
+# (CSV cap + 64 KB slack for the other form fields and multipart framing).
+app.config["MAX_CONTENT_LENGTH"] = MAX_CSV_BYTES + 64 * 1024 if MAX_CSV_BYTES else None
 
 # Two-digit year pivot (e.g., 00..30 → 2000..2030; 31..99 → 1931..1999)
 YY_PIVOT = 30
 
+# Funder metadata changes rarely; memoize lookups per process for this many
+# seconds. Set env KMKO_META_TTL to override (0 effectively disables).
+KMKO_META_TTL = float(os.getenv("KMKO_META_TTL", "60"))
+_meta_cache = TTLCache(maxsize=256, ttl=KMKO_META_TTL)
+_meta_lock = threading.Lock()
+
+# Optional Redis: shares the funder cache across workers and hands bulk CSV
+# uploads to an RQ worker (`rq worker kmko-bulk`). Without REDIS_URL, lookups
+# use only the per-process cache and uploads are processed inline (local dev).
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+FUNDER_CACHE_TTL = int(os.getenv("KMKO_FUNDER_CACHE_TTL", "300"))  # seconds, in Redis
+BULK_QUEUE_NAME = os.getenv("KMKO_BULK_QUEUE", "kmko-bulk")
+BULK_JOB_TTL = 24 * 3600  # seconds to keep queued upload bytes and job results
+redis_conn = (
+    Redis(connection_pool=ConnectionPool.from_url(REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS))
+    if REDIS_URL else None
+)
+bulk_queue = Queue(BULK_QUEUE_NAME, connection=redis_conn) if redis_conn else None
+
 # --------------------------
 # DB helpers
 # --------------------------
+FUNDERS_CACHE_KEY = "kmko:funders:v1"
+FUNDER_CACHE_KEY = "kmko:funder:{route_name}:v1"
+
+def cached_exec(key: str, ttl: int, fn):
+    """
+    Shared cache across workers: return the value stored at `key` in Redis,
+    or call fn(), store its JSON for `ttl` seconds and return it.
+    Hits and misses both return the JSON round-trip, so every worker sees
+    identical values. A None result is never stored, so arbitrary keys
+    (e.g. probed routes) don't pile up. Without Redis (or if it errors)
+    this is just fn().
+    """
+    if redis_conn is None:
+        return fn()
+    try:
+        hit = redis_conn.get(key)
+    except RedisError:
+        return fn()
+    if hit is not None:
+        return orjson.loads(hit)
+
+    result = fn()
+    if result is None:
+        return None
+    encoded = orjson.dumps(result, default=str)
+    try:
+        redis_conn.set(key, encoded, ex=ttl)
+    except RedisError:
+        pass
+    return orjson.loads(encoded)
+
+
+@cached(_meta_cache, key=lambda: ("funders",), lock=_meta_lock)
 def fetch_funders() -> List[Dict]:
     """
     Return all funders (FunderID, Description, RouteName[, BulkUpload]).
     The stored proc should include BulkUpload if you want to show it in the list.
+    Results are cached for KMKO_META_TTL seconds per process, and for
+    KMKO_FUNDER_CACHE_TTL seconds in Redis when configured.
     """
-    with get_engine().connect() as conn:
-        return (
+    return cached_exec(FUNDERS_CACHE_KEY, FUNDER_CACHE_TTL, _query_funders)
+
+
+def _query_funders() -> List[Dict]:
+    with ENGINE.connect() as conn:
+        rows = (
             conn.execute(
                 text("EXEC dbo.KMKO_HelperFunctions @Request=:r"),
                 {"r": "ListFunders"},
@@ -46,12 +119,35 @@ def fetch_funders() -> List[Dict]:
             .mappings()
             .all()
         )
+    return [dict(r) for r in rows]  # plain dicts: safe to cache
 
 
 def fetch_funder_by_route(route_name: str) -> Optional[dict]:
-    """Return a single funder by RouteName, or None if not found."""
-    with get_engine().connect() as conn:
-        return (
+    """
+    Return a single funder by RouteName, or None if not found.
+    Found funders are cached like fetch_funders(); misses are not cached, so
+    arbitrary paths (scanners, /favicon.ico) can't evict real funders.
+    """
+    key = ("by_route", route_name)
+    with _meta_lock:
+        funder = _meta_cache.get(key)
+    if funder is not None:
+        return funder
+
+    funder = cached_exec(
+        FUNDER_CACHE_KEY.format(route_name=route_name),
+        FUNDER_CACHE_TTL,
+        lambda: _query_funder_by_route(route_name),
+    )
+    if funder is not None:
+        with _meta_lock:
+            _meta_cache[key] = funder
+    return funder
+
+
+def _query_funder_by_route(route_name: str) -> Optional[dict]:
+    with ENGINE.connect() as conn:
+        row = (
             conn.execute(
                 text(
                     "EXEC dbo.KMKO_HelperFunctions @Request=:r, @RouteName=:rn"
@@ -61,10 +157,30 @@ def fetch_funder_by_route(route_name: str) -> Optional[dict]:
             .mappings()
             .first()
         )
+    return dict(row) if row else None
+
+
+INSERT_PARTICIPANT_SQL = text(
+    """
+    EXEC dbo.KMKO_HelperFunctions
+        @Request=:r,
+        @FunderID=:fid,
+        @FirstName=:fn,
+        @LastName=:ln,
+        @DateOfBirth=:dob,
+        @ConsentGiven=:cg
+    """
+)
 
 # --------------------------
 # Date parsing helpers
 # --------------------------
+_NON_DIGIT = re.compile(r"\D")
+# str.translate table that drops every ASCII non-digit (fast path for ASCII input)
+_ASCII_DIGITS_ONLY = str.maketrans(
+    "", "", "".join(chr(c) for c in range(128) if not chr(c).isdigit())
+)
+
 def _apply_century_sanity(dt: datetime) -> datetime:
     """If parsed date is in the future (vs today), roll back 100 years."""
     today = date.today()
@@ -87,54 +203,73 @@ def _parse_digits_compact(s: str, prefer_day_first: bool) -> Optional[datetime]:
     if not s.isdigit():
         return None
 
-    def build(y, m, d):
-        y, m, d = int(y), int(m), int(d)
-        return datetime(y, m, d)  # raises ValueError if invalid
-
     if len(s) == 8:
-        # Prepare attempt orders based on preference
+        # One int() and pure arithmetic instead of slicing; triples are (y, m, d)
+        n = int(s)
+        ddmmyyyy = (n % 10000, (n // 10000) % 100, n // 1000000)
+        yyyymmdd = (n // 10000, (n // 100) % 100, n % 100)
+        mmddyyyy = (n % 10000, n // 1000000, (n // 10000) % 100)
         if prefer_day_first:
-            attempts = [
-                ("DDMMYYYY", (s[4:8], s[2:4], s[0:2])),  # y, m, d
-                ("YYYYMMDD", (s[0:4], s[4:6], s[6:8])),
-                ("MMDDYYYY", (s[4:8], s[0:2], s[2:4])),
-            ]
+            attempts = (ddmmyyyy, yyyymmdd, mmddyyyy)
         else:
-            attempts = [
-                ("MMDDYYYY", (s[4:8], s[0:2], s[2:4])),
-                ("YYYYMMDD", (s[0:4], s[4:6], s[6:8])),
-                ("DDMMYYYY", (s[4:8], s[2:4], s[0:2])),
-            ]
-        for _, (yy, mm, dd) in attempts:
-            try:
-                return build(yy, mm, dd)
-            except ValueError:
-                continue
+            attempts = (mmddyyyy, yyyymmdd, ddmmyyyy)
+    elif len(s) == 6:
+        # Two-digit year with pivot
+        n = int(s)
+        yy = n % 100
+        yyyy = 2000 + yy if yy <= YY_PIVOT else 1900 + yy
+        ddmmyy = (yyyy, (n // 100) % 100, n // 10000)
+        mmddyy = (yyyy, n // 10000, (n // 100) % 100)
+        attempts = (ddmmyy, mmddyy) if prefer_day_first else (mmddyy, ddmmyy)
+    else:
         return None
 
-    if len(s) == 6:
-        # Two-digit year with pivot
-        def year_from_yy(yy2: str) -> int:
-            val = int(yy2)
-            return 2000 + val if val <= YY_PIVOT else 1900 + val
-
-        orders = [
-            ("DDMMYY", (year_from_yy(s[4:6]), s[2:4], s[0:2])),
-            ("MMDDYY", (year_from_yy(s[4:6]), s[0:2], s[2:4])),
-        ]
-        if not prefer_day_first:
-            orders.reverse()
+    for y, m, d in attempts:
+        try:
+            return datetime(y, m, d)  # raises ValueError if invalid
+        except ValueError:
+            continue
+    return None
 
-        for _, (yyyy, mm, dd) in orders:
-            try:
-                return build(yyyy, mm, dd)
-            except ValueError:
-                continue
-        return None
 
+# Strict separated layouts. Tried before the digit-stripping path so the
+# separators fix field widths (1/2/2013 is 1 Feb, not 12/20/13).
+_SEPARATED_FORMATS = {
+    "/": ("%d/%m/%Y", "%m/%d/%Y"),
+    "-": ("%d-%m-%Y", "%m-%d-%Y"),
+    ".": ("%d.%m.%Y", "%m.%d.%Y"),
+}
+
+def _parse_separated(s: str, prefer_day_first: bool) -> Optional[datetime]:
+    """
+    Handle D/M/YYYY-style input (separators / - .) and ISO YYYY-MM-DD.
+    Return datetime or None if `s` is not in one of these layouts.
+    """
+    if len(s) > 4 and s[4] == "-" and s[:4].isdigit():
+        formats = ("%Y-%m-%d",)
+    else:
+        sep = next((c for c in s if not c.isdigit()), "")
+        formats = _SEPARATED_FORMATS.get(sep)
+        if formats is None:
+            return None
+        if not prefer_day_first:
+            formats = formats[::-1]
+
+    for fmt in formats:
+        try:
+            return datetime.strptime(s, fmt)
+        except ValueError:
+            continue
     return None
 
 
+# Other NZ-style layouts (month names, 2-digit years), tried before the much
+# slower dateutil grammar. %y maps 00..68 → 20xx; century sanity fixes the rest.
+_FALLBACK_FORMATS = (
+    "%d %b %Y", "%d %B %Y", "%d-%b-%Y", "%d-%B-%Y",
+    "%d/%m/%y", "%d-%m-%y", "%d.%m.%y", "%d %b %y",
+)
+
 def parse_any_date(dob_str: str, prefer_day_first: bool = True) -> str:
     """
     Parse a wide range of DOB formats and return ISO 'YYYY-MM-DD'.
@@ -147,8 +282,14 @@ def parse_any_date(dob_str: str, prefer_day_first: bool = True) -> str:
     if not s:
         raise ValueError("Date is required")
 
+    # Common separated layouts (DD/MM/YYYY, YYYY-MM-DD, ...)
+    dt = _parse_separated(s, prefer_day_first)
+    if dt:
+        dt = _apply_century_sanity(dt)
+        return dt.strftime("%Y-%m-%d")
+
     # Fast path for compact digits (includes DDMMYYYY / YYYYMMDD / MMDDYYYY, etc.)
-    digits_only = re.sub(r"\D", "", s)
+    digits_only = s.translate(_ASCII_DIGITS_ONLY) if s.isascii() else _NON_DIGIT.sub("", s)
     try:
         dt = _parse_digits_compact(digits_only, prefer_day_first)
         if dt:
@@ -157,6 +298,16 @@ def parse_any_date(dob_str: str, prefer_day_first: bool = True) -> str:
     except ValueError:
         pass  # fall through to general parsing
 
+    # Known layouts via strptime
+    if prefer_day_first:
+        for fmt in _FALLBACK_FORMATS:
+            try:
+                dt = datetime.strptime(s, fmt)
+            except ValueError:
+                continue
+            dt = _apply_century_sanity(dt)
+            return dt.strftime("%Y-%m-%d")
+
     # General parsing with dateutil, try day-first then month-first
     try:
         dt = dateparser.parse(s, dayfirst=prefer_day_first, yearfirst=False, fuzzy=True)
@@ -186,55 +337,221 @@ HEADER_ALIASES = {
     "birthdate": "DateOfBirth", "birth_date": "DateOfBirth",
 }
 
+_NON_ALNUM = re.compile(r"[^a-z0-9]")
+
+def _normalize_header(name: str) -> str:
+    return _NON_ALNUM.sub("", str(name).lower())
+
+# Raw header spellings seen most often in uploads
+_COMMON_RAW_HEADERS = (
+    "FirstName", "First Name", "First_Name", "first name", "Given Name", "GivenName",
+    "LastName", "Last Name", "Last_Name", "last name", "Surname", "Family Name", "FamilyName",
+    "DateOfBirth", "Date of Birth", "Date Of Birth", "Date_Of_Birth", "date of birth",
+    "DOB", "Birth Date", "BirthDate",
+)
+
+# Exact-match table built once at import: the aliases plus the raw spellings
+# above, so common headers resolve with one dict hit and no normalization.
+_ALIAS_LOOKUP: Dict[str, str] = {
+    **HEADER_ALIASES,
+    **{raw: HEADER_ALIASES[_normalize_header(raw)] for raw in _COMMON_RAW_HEADERS},
+}
+
+@lru_cache(maxsize=512)
 def _canon_header(name: str) -> Optional[str]:
-    key = re.sub(r"[^a-z0-9]", "", str(name).lower())
-    return HEADER_ALIASES.get(key)
+    return _ALIAS_LOOKUP.get(name) or _ALIAS_LOOKUP.get(_normalize_header(name))
 
-def load_csv_flex(file_storage) -> pd.DataFrame:
+def load_csv_flex(raw: bytes) -> List[Tuple[int, str, str, str]]:
     """
-    Returns a DataFrame with canonical columns: FirstName, LastName, DateOfBirth.
+    Returns (row_number, FirstName, LastName, DateOfBirth) tuples, stripped.
     - Accepts any order via alias mapping
     - Accepts headerless CSVs (assumes first 3 columns are the required fields)
-    - Extra columns are ignored
+    - Extra columns are ignored; blank lines are skipped
+    row_number is the 1-based row in the file, for error messages.
     """
-    file_storage.stream.seek(0)
-    text_data = file_storage.stream.read().decode("utf-8", errors="ignore")
-
-    # Try headered first
-    df = pd.read_csv(io.StringIO(text_data), dtype=str).fillna("")
-    df.columns = [_canon_header(c) or c for c in df.columns]
-    if all(c in df.columns for c in REQUIRED_COLS):
-        return df[REQUIRED_COLS].copy()
-
-    # Fallback: headerless -> take first three columns
-    df2 = pd.read_csv(io.StringIO(text_data), dtype=str, header=None).fillna("")
-    if df2.shape[1] >= 3:
-        df2 = df2.rename(columns={0: "FirstName", 1: "LastName", 2: "DateOfBirth"})
-        return df2[REQUIRED_COLS].copy()
-
-    raise ValueError(
-        "Missing required columns. Expect FirstName, LastName, DateOfBirth "
-        "(with headers in any order or as the first three columns)."
-    )
+    reader = csv.reader(io.StringIO(raw.decode("utf-8-sig", errors="ignore")))  # -sig: drop Excel BOM
+    first_row = next(reader, [])
+
+    canon = [_canon_header(c) for c in first_row]
+    if all(c in canon for c in REQUIRED_COLS):
+        positions = [canon.index(c) for c in REQUIRED_COLS]
+        start = 2
+    elif len(first_row) >= 3:
+        # Fallback: headerless -> take first three columns
+        positions = [0, 1, 2]
+        reader = itertools.chain([first_row], reader)
+        start = 1
+    else:
+        raise ValueError(
+            "Missing required columns. Expect FirstName, LastName, DateOfBirth "
+            "(with headers in any order or as the first three columns)."
+        )
 
-def validate_row(row: dict) -> List[str]:
-    """Return a list of validation error messages for a row dict."""
-    errs: List[str] = []
-    if not (row.get("FirstName") or "").strip():
-        errs.append("FirstName is required")
-    if not (row.get("LastName") or "").strip():
-        errs.append("LastName is required")
-    if not (row.get("DateOfBirth") or "").strip():
-        errs.append("DateOfBirth is required")
-
-    # date format check
-    if (row.get("DateOfBirth") or "").strip():
-        try:
-            parse_any_date(row["DateOfBirth"])
-        except ValueError as e:
-            errs.append(str(e))
+    rows: List[Tuple[int, str, str, str]] = []
+    for row_number, row in enumerate(reader, start):
+        if not row:
+            continue
+        first, last, dob = (row[i].strip() if i < len(row) else "" for i in positions)
+        rows.append((row_number, first, last, dob))
+    return rows
+
+def validate_rows(rows: List[Tuple[int, str, str, str]]) -> Tuple[List[tuple], List[Dict]]:
+    """
+    Validate rows from load_csv_flex().
+
+    Returns (errors, records):
+      - errors: [(row_number, [messages])] for rows that failed
+      - records: [{"FirstName", "LastName", "DateISO"}] for rows that passed
+    """
+    errors: List[tuple] = []
+    records: List[Dict] = []
+    for row_number, first, last, dob in rows:
+        errs: List[str] = []
+        if not first:
+            errs.append("FirstName is required")
+        if not last:
+            errs.append("LastName is required")
+        if not dob:
+            errs.append("DateOfBirth is required")
+        else:
+            try:
+                dob_iso = parse_any_date(dob)
+            except ValueError as e:
+                errs.append(str(e))
 
-    return errs
+        if errs:
+            errors.append((row_number, errs))
+        else:
+            records.append({"FirstName": first, "LastName": last, "DateISO": dob_iso})
+    return errors, records
+
+# --------------------------
+# Bulk upload processing (inline or in the RQ worker)
+# --------------------------
+def process_bulk_csv(raw: bytes, funder_id, consent: bool) -> Tuple[bool, str]:
+    """
+    Parse, validate and insert an uploaded CSV for one funder.
+    Nothing is inserted unless every row validates.
+    Returns (ok, message) for display to the uploader; DB errors propagate.
+    """
+    try:
+        # Flexible read (aliases + headerless)
+        rows = load_csv_flex(raw)
+    except (ValueError, csv.Error) as e:
+        return False, f"Error processing CSV: {e}"
+
+    errors, to_insert = validate_rows(rows)
+    if errors:
+        # Summarize first ~10 error rows to keep flash readable
+        preview = "; ".join(
+            [f"Row {r}: {', '.join(es)}" for r, es in errors[:10]]
+        )
+        more = "" if len(errors) <= 10 else f" (+{len(errors) - 10} more rows)"
+        return False, f"Validation failed for {len(errors)} row(s): {preview}{more}"
+
+    if not to_insert:
+        return False, "No valid rows to upload after validation."
+
+    # Insert all valid rows in one batch (fast_executemany on pyodbc)
+    with ENGINE.begin() as conn:
+        conn.execute(
+            INSERT_PARTICIPANT_SQL,
+            [
+                {
+                    "r": "InsertParticipant",
+                    "fid": funder_id,
+                    "fn": rec["FirstName"],
+                    "ln": rec["LastName"],
+                    "dob": rec["DateISO"],
+                    "cg": consent,  # ✅ pass consent flag to SP
+                }
+                for rec in to_insert
+            ],
+        )
+
+    return True, f"Uploaded {len(to_insert)} participant(s) successfully."
+
+def _bulk_csv_key(job_id: str) -> str:
+    return f"kmko:bulk:{job_id}:csv"
+
+def process_bulk_job(job_id: str, funder_id, consent: bool) -> Tuple[bool, str]:
+    """RQ entrypoint: process the upload stored under `job_id`, then drop it."""
+    key = _bulk_csv_key(job_id)
+    raw = redis_conn.get(key)
+    if raw is None:
+        return False, "The uploaded file expired before it was processed. Please upload it again."
+    try:
+        return process_bulk_csv(raw, funder_id, consent)
+    finally:
+        redis_conn.delete(key)
+
+def enqueue_bulk_csv(raw: bytes, funder_id, consent: bool, route_name: str) -> Optional[str]:
+    """
+    Hand an upload to the RQ worker and return its job id, or None if it
+    should be processed inline instead: no Redis configured, no worker
+    listening on the queue (e.g. the Docker image runs only gunicorn), or
+    Redis failing.
+    """
+    if bulk_queue is None:
+        return None
+    try:
+        if not Worker.count(queue=bulk_queue):
+            app.logger.warning("No RQ worker on %r; processing upload inline", BULK_QUEUE_NAME)
+            return None
+        job_id = uuid.uuid4().hex
+        redis_conn.set(_bulk_csv_key(job_id), raw, ex=BULK_JOB_TTL)
+        bulk_queue.enqueue(
+            "run.process_bulk_job",
+            job_id, funder_id, consent,
+            job_id=job_id,
+            meta={"route_name": route_name},
+            result_ttl=BULK_JOB_TTL,
+            failure_ttl=BULK_JOB_TTL,
+        )
+    except RedisError as e:
+        app.logger.warning("Could not queue upload (%s); processing inline", e)
+        return None
+    return job_id
+
+# --------------------------
+# HTTP caching helpers
+# --------------------------
+# Browsers/proxies may reuse funder pages this long before revalidating.
+PAGE_MAX_AGE = int(os.getenv("PAGE_MAX_AGE", "60"))
+
+def _templates_digest() -> str:
+    """Hash of every template's source, taken once at startup."""
+    digest = hashlib.md5(usedforsecurity=False)
+    root = os.path.join(app.root_path, app.template_folder)
+    for dirpath, _dirs, files in sorted(os.walk(root)):
+        for name in sorted(files):
+            with open(os.path.join(dirpath, name), "rb") as f:
+                digest.update(name.encode() + f.read())
+    return digest.hexdigest()
+
+# Per-deploy token mixed into every ETag so cached pages are invalidated when
+# the markup changes. Set APP_VERSION (e.g. a git SHA) or fall back to a hash
+# of the templates.
+APP_VERSION = os.getenv("APP_VERSION") or _templates_digest()
+
+def _etag_for(*parts) -> str:
+    """Stable ETag for the data a page is rendered from, plus APP_VERSION."""
+    return hashlib.md5(repr((APP_VERSION, parts)).encode(), usedforsecurity=False).hexdigest()
+
+def cacheable_response(etag: str, render):
+    """
+    Answer 304 if the client already holds `etag`; otherwise call render()
+    and tag the response. Either way, allow shared caching for PAGE_MAX_AGE.
+    The pages read the session (flashes), so both branches send Vary: Cookie.
+    """
+    if etag in request.if_none_match:
+        resp = make_response("", 304)
+    else:
+        resp = make_response(render())
+    resp.set_etag(etag)
+    resp.vary.add("Cookie")
+    resp.headers["Cache-Control"] = f"public, max-age={PAGE_MAX_AGE}"
+    return resp
 
 # --------------------------
 # Routes
@@ -246,7 +563,10 @@ def index():
 @app.get("/funders")
 def list_funders():
     funders = fetch_funders()
-    return render_template("kmko_funders.html", funders=funders)
+    return cacheable_response(
+        _etag_for("funders", funders),
+        lambda: render_template("kmko_funders.html", funders=funders),
+    )
 
 @app.route("/<route_name>", methods=["GET", "POST"])
 def record_participation(route_name: str):
@@ -263,9 +583,11 @@ def record_participation(route_name: str):
 
     # -------- GET --------
     if request.method == "GET":
-        if is_bulk:
-            return render_template("kmko_bulk_upload.html", funder=funder)
-        return render_template("kmko_form.html", funder=funder, form={})
+        template = "kmko_bulk_upload.html" if is_bulk else "kmko_form.html"
+        return cacheable_response(
+            _etag_for(template, funder),
+            lambda: render_template(template, funder=funder, form={}),
+        )
 
     # -------- POST --------
     if is_bulk:
@@ -281,92 +603,26 @@ def record_participation(route_name: str):
             flash("Please choose a CSV file to upload.", "danger")
             return render_template("kmko_bulk_upload.html", funder=funder), 400
 
-        # Optional file size cap
-        file.seek(0, os.SEEK_END)
-        size = file.tell()
-        file.seek(0)
-        if MAX_CSV_BYTES and size > MAX_CSV_BYTES:
+        # Read once, at most one byte past the optional size cap
+        raw = file.stream.read(MAX_CSV_BYTES + 1) if MAX_CSV_BYTES else file.stream.read()
+        if MAX_CSV_BYTES and len(raw) > MAX_CSV_BYTES:
             flash("File is too large. Please keep it under the configured limit.", "danger")
             return render_template("kmko_bulk_upload.html", funder=funder), 400
 
-        try:
-            # Flexible read (aliases + headerless)
-            df = load_csv_flex(file)
-
-            # Trim whitespace
-            for c in df.columns:
-                df[c] = df[c].map(lambda x: x.strip() if isinstance(x, str) else x)
-
-            errors: List[tuple] = []
-            to_insert: List[Dict] = []
-
-            for idx, row in df.iterrows():
-                row_dict = {c: row.get(c, "") for c in REQUIRED_COLS}
-                row_errs = validate_row(row_dict)
-                if row_errs:
-                    errors.append((idx + 2, row_errs))  # +2: header + 1-based idx for UX
-                    continue
-
-                to_insert.append(
-                    {
-                        "FirstName": row_dict["FirstName"],
-                        "LastName": row_dict["LastName"],
-                        "DateISO": parse_any_date(row_dict["DateOfBirth"]),
-                    }
-                )
-
-            if errors:
-                # Summarize first ~10 error rows to keep flash readable
-                preview = "; ".join(
-                    [f"Row {r}: {', '.join(es)}" for r, es in errors[:10]]
-                )
-                more = "" if len(errors) <= 10 else f" (+{len(errors) - 10} more rows)"
-                flash(
-                    f"Validation failed for {len(errors)} row(s): {preview}{more}",
-                    "danger",
-                )
-                return render_template("kmko_bulk_upload.html", funder=funder), 400
-
-            # Insert all valid rows in one DB call via JSON payload
-            if not to_insert:
-                flash("No valid rows to upload after validation.", "danger")
-                return render_template("kmko_bulk_upload.html", funder=funder), 400
-
-            payload = json.dumps([
-                {
-                    "FirstName": rec["FirstName"],
-                    "LastName":  rec["LastName"],
-                    "DateISO":   rec["DateISO"],
-                    "Consent":   bulk_consent,  # carry through per-record (optional)
-                }
-                for rec in to_insert
-            ])
-
-            with get_engine().begin() as conn:
-                conn.execute(
-                    text("""
-                        EXEC dbo.KMKO_HelperFunctions
-                            @Request=:r,
-                            @FunderID=:fid,
-                            @Payload=:payload,
-                            @ConsentGiven=:cg
-                    """),
-                    {
-                        "r": "BulkInsertParticipantsJson",
-                        "fid": funder_id,
-                        "payload": payload,
-                        "cg": bulk_consent,   # ✅ pass consent flag to SP
-                    },
-                )
-
-            inserted = len(to_insert)
-            flash(f"Uploaded {inserted} participant(s) successfully.", "success")
-            return render_template("kmko_bulk_upload.html", funder=funder)
+        # Queue it when a worker is available; otherwise process inline below
+        job_id = enqueue_bulk_csv(raw, funder_id, bulk_consent, route_name)
+        if job_id:
+            return redirect(url_for("bulk_status", route_name=route_name, job_id=job_id))
 
+        try:
+            ok, message = process_bulk_csv(raw, funder_id, bulk_consent)
         except Exception as e:
             flash(f"Error processing CSV: {e}", "danger")
             return render_template("kmko_bulk_upload.html", funder=funder), 500
 
+        flash(message, "success" if ok else "danger")
+        return render_template("kmko_bulk_upload.html", funder=funder), (200 if ok else 400)
+
     # Single-form branch
     first = (request.form.get("FirstName") or "").strip()
     last = (request.form.get("LastName") or "").strip()
@@ -399,19 +655,9 @@ def record_participation(route_name: str):
 
     # Insert via stored proc (no row read)
     try:
-        with get_engine().begin() as conn:
+        with ENGINE.begin() as conn:
             conn.execute(
-                text(
-                    """
-                    EXEC dbo.KMKO_HelperFunctions
-                        @Request=:r,
-                        @FunderID=:fid,
-                        @FirstName=:fn,
-                        @LastName=:ln,
-                        @DateOfBirth=:dob,
-                        @ConsentGiven=:cg
-                    """
-                ),
+                INSERT_PARTICIPANT_SQL,
                 {
                     "r": "InsertParticipant",
                     "fid": funder_id,
@@ -433,6 +679,32 @@ def submission_success(route_name: str):
     first = (request.args.get("first") or "").strip() or None
     return render_template("kmko_success.html", funder=funder, first=first)
 
+@app.get("/<route_name>/uploads/<job_id>")
+def bulk_status(route_name: str, job_id: str):
+    """Progress page for a queued bulk upload; shows the result once done."""
+    funder = fetch_funder_by_route(route_name)
+    if not funder or bulk_queue is None:
+        abort(404)
+    try:
+        job = Job.fetch(job_id, connection=redis_conn)
+    except NoSuchJobError:
+        abort(404)
+    if job.meta.get("route_name") != route_name:
+        abort(404)
+
+    status = job.get_status()
+    if status == JobStatus.FINISHED:
+        ok, message = job.return_value()
+        flash(message, "success" if ok else "danger")
+        return render_template("kmko_bulk_upload.html", funder=funder)
+    if status in (JobStatus.FAILED, JobStatus.STOPPED, JobStatus.CANCELED):
+        flash("Error processing CSV. Please try the upload again.", "danger")
+        return render_template("kmko_bulk_upload.html", funder=funder)
+
+    resp = make_response(render_template("kmko_bulk_status.html", funder=funder))
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
 # --------------------------
 # Error handlers
 # --------------------------
@@ -440,15 +712,46 @@ def submission_success(route_name: str):
 def not_found(_e):
     return jsonify(error="not_found", message="The requested resource was not found."), 404
 
+@app.errorhandler(413)
+def too_large(_e):
+    # Browser form posts get the upload page back with the usual flash
+    route_name = (request.view_args or {}).get("route_name")
+    funder = fetch_funder_by_route(route_name) if route_name else None
+    if funder and request.accept_mimetypes.accept_html:
+        flash("File is too large. Please keep it under the configured limit.", "danger")
+        if funder.get("BulkUpload", 0):
+            return render_template("kmko_bulk_upload.html", funder=funder), 413
+        return render_template("kmko_form.html", funder=funder, form={}), 413
+    return jsonify(error="too_large", message="The upload is larger than the configured limit."), 413
+
 @app.errorhandler(500)
 def server_error(e):
     return jsonify(error="server_error", message=str(e)), 500
 
+# --------------------------
+# CLI
+# --------------------------
+@app.cli.command("clear-funder-cache")
+def clear_funder_cache():
+    """Drop cached funder lookups from Redis after editing funders in the DB."""
+    if redis_conn is None:
+        print("REDIS_URL is not set; nothing to clear.")
+        return
+    keys = [FUNDERS_CACHE_KEY, *redis_conn.scan_iter(FUNDER_CACHE_KEY.format(route_name="*"))]
+    redis_conn.delete(*keys)
+    print(f"Cleared {len(keys)} key(s). Per-process caches expire within {KMKO_META_TTL:g}s.")
+
 # --------------------------
 # Local dev entrypoint
 # --------------------------
 if __name__ == "__main__":
-    # In production, use: gunicorn run:app --bind 0.0.0.0:10000
+    # In production, run gunicorn with threaded workers (see Procfile / Dockerfile):
+    #   gunicorn run:app --workers 2 --worker-class gthread --threads 8 --bind 0.0.0.0:10000
+    # Requests spend most of their time waiting on Azure SQL, and pyodbc releases
+    # the GIL while it waits, so threads overlap that latency. Prefer gthread over
+    # gevent: pyodbc's blocking calls can't be monkey-patched into greenlets.
+    # Each worker has its own DB pool: keep DB_POOL_SIZE >= threads per worker;
+    # fleet-wide logins can reach workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) (see db.py).
     port = int(os.getenv("PORT", "10000"))
     debug = os.getenv("FLASK_DEBUG", "0") == "1"
     app.run(host="0.0.0.0", port=port, debug=debug)